@@ -1,7 +1,8 @@
 # A generic tokenizer driven by regular expressions
 
 from collections import namedtuple
-from enum import Enum
+from enum import Enum, IntEnum
+from functools import lru_cache
 import re
 
 # Regular-expression line-oriented tokenizer.
@@ -16,7 +17,8 @@ import re
 #    ... subclasses   Various subclasses of TokenMatch for special functions
 #
 #    Token            The Tokenizer produces these.
-#    TokenID          An Enum type dynamically created by the Tokenizer
+#    TokenBatch       ... or these, many tokens at a time (tokens_batch)
+#    TokenID          An IntEnum type dynamically created by the Tokenizer
 #                     from all of the TokenMatch specifications; this is the
 #                     type of each individual Token (i.e., what it matched)
 #
@@ -30,6 +32,36 @@ import re
 
 Token = namedtuple('Token', ['id', 'value', 'location'])
 
+# Tokenizer.tokens_batch() produces these instead of individual Tokens.
+# Each field is a list (except locations, which can be None); the Nth
+# token in the batch is made of the Nth element of each list.
+
+TokenBatch = namedtuple('TokenBatch',
+                        ['ids', 'values', 'linenos', 'starts', 'ends',
+                         'locations'])
+
+
+# Compiling the joined regexp is the most expensive part of making a
+# Tokenizer. Tokenizers made from the same rules (the joined regexp
+# is entirely determined by them) share the compiled result via this.
+# The cache is bounded (least recently used results are dropped), so
+# applications making Tokenizers from ever-changing rules don't grow it.
+@lru_cache(maxsize=128)
+def _compile(remodule, joined_rx):
+    return remodule.compile(joined_rx)
+
+
+# The automatically-created TokenID Enums are IntEnums, so comparing
+# and hashing them is int comparing and hashing. They still print
+# (str/format) like a plain Enum would, e.g., "TokenID.IDENTIFIER"
+#
+# NOTE: That also means ids from DIFFERENT Tokenizers (each has its own
+#       TokenID) compare, and hash, equal when their values are equal.
+
+class _TokenIDEnum(IntEnum):
+    __str__ = Enum.__str__
+    __format__ = Enum.__format__
+
 
 class Tokenizer:
     """Break streams into tokens with rules from regexps."""
@@ -37,7 +69,8 @@ class Tokenizer:
     def __init__(self, tms, strings=None, /, *,
                  srcname=None, startnum=1,
                  tokenIDs=None,
-                 tokentype=Token):
+                 tokentype=Token,
+                 remodule=re):
         """Set up a Tokenizer; see tokens() to generate tokens.
 
         Arguments:
@@ -71,31 +104,112 @@ class Tokenizer:
                        automatically, it can be provided here.
 
            tokentype -- will be used in lieu of Token(), if provided.
+
+           remodule -- the regular expression module used to compile
+                       (and therefore match) the rules. Default is re.
+                       Anything re-compatible works, e.g., the third-party
+                       'regex' module. What gets used (all with the same
+                       semantics as re) is:
+                          module:  compile()
+                          pattern: match(s, pos), finditer(s, pos),
+                                   groups, groupindex
+                          match:   lastindex, group(0), start(), end()
+                       and compile() must accept re syntax including
+                       (?P<name>...), (?:...), (?!...), and character
+                       classes of re.escape()'d characters.
         """
 
-        tmsmap = self.__tmscvt(tms)
-        self.TokenID = tokenIDs or self.create_tokenID_enum(tmsmap)
+        # The rules are already built if this is a specialize() class
+        # (and these are its rules); otherwise build them now.
+        spec = self._specialized
+        if spec is not None and tms is spec[0]:
+            built = spec[1]
+        else:
+            built = self._build_rules(tms, tokenIDs, remodule)
+        self.TokenID, self.rulesets = built
+
+        self.strings = strings
+        self.rules = self.rulesets[None]
+        self.startnum = startnum
+        self.srcname = srcname
+        self.tokentype = tokentype
+
+    # Set by specialize() to (tms, _build_rules(tms, ...)) for the rules
+    # that are built into the class it makes.
+    _specialized = None
+
+    @classmethod
+    def _build_rules(cls, tms, tokenIDs, remodule):
+        """Return (TokenID, rulesets) made from rules tms."""
+
+        tmsmap = cls.__tmscvt(tms)
+        TokenID = tokenIDs or cls.create_tokenID_enum(tmsmap)
+
+        # For a TokenMatch whose action() is the base action() (see
+        # TokenMatch._passthrough), precompute what that action() would
+        # need, so _scan can do the same thing inline:
+        #     (TokenID member, converter)
+        # where converter is None if _value() is the base (no-op) _value.
+        # This also avoids Enum __getitem__, which is comparatively slow.
+        #
+        # NOTE: a caller-supplied tokenIDs might not have every tokname;
+        #       those get None and fail (KeyError) in action().
+        def _inline(tm):
+            if not tm._passthrough:
+                return None
+            try:
+                tokid = TokenID[tm.tokname]
+            except KeyError:
+                return None
+            cvt = tm._value
+            if getattr(cvt, '__func__', None) is TokenMatch._value:
+                cvt = None
+            return tokid, cvt
 
         # each named ruleset will become one regexp with a (?P=name)
         # annotation for each individual regexp in it. The 'name' in
         # those annotations is a "pname" and it is not the same as
         # the tokname because toknames are allowed to be duplicated.
         #
-        RuleSet = namedtuple('RuleSet', ['joined_rx', 'pmap', 'name'])
-
-        self.rulesets = {}
+        # The joined regexp is compiled once (with remodule), here, rather
+        # than being looked up in the re module cache on every string.
+        #
+        # The pmap is a list indexed by group number, so that a match
+        # can be mapped to its TokenMatch via mobj.lastindex (an int)
+        # rather than hashing the mobj.lastgroup string. The outermost
+        # (pname) group always closes last, so lastindex is always a
+        # pname group number even if the TokenMatch regexp has groups
+        # of its own (which is also why pmap has holes, i.e., None).
+        # The inline list is parallel to pmap: the _inline() of each
+        # TokenMatch. A _TokenMatchGroup has its own inline_by_value,
+        # parallel to its tms_by_value. (The TokenMatch objects are
+        # never hashed; they might not be hashable, or might compare
+        # equal to each other.)
+        RuleSet = namedtuple('RuleSet',
+                             ['compiled', 'pmap', 'inline', 'name'])
+
+        rulesets = {}
         for name, tms in tmsmap.items():
-            pmap = {f"PN{i:04d}": tm for i, tm in enumerate(tms)}
+            tms = cls._combine_rules(tms)
+            pnames = {f"PN{i:04d}": tm for i, tm in enumerate(tms)
+                      if tm.regexp is not None}
             joined_rx = '|'.join(f'(?P<{pname}>{tm.regexp})'
-                                 for pname, tm in pmap.items()
-                                 if tm.regexp is not None)
-            self.rulesets[name] = RuleSet(joined_rx, pmap, name)
+                                 for pname, tm in pnames.items())
+            compiled = _compile(remodule, joined_rx)
+            pmap = [None] * (compiled.groups + 1)
+            inline = [None] * (compiled.groups + 1)
+            for pname, tm in pnames.items():
+                i = compiled.groupindex[pname]
+                pmap[i] = tm
+                if tm.__class__ is _TokenMatchGroup:
+                    tm.inline_by_value = {
+                        value: _inline(x)
+                        for value, x in tm.tms_by_value.items()}
+                else:
+                    inline[i] = _inline(tm)
+            rulesets[name] = RuleSet(compiled, pmap, inline, name)
 
-        self.strings = strings
-        self.rules = self.rulesets[None]
-        self.startnum = startnum
-        self.srcname = srcname
-        self.tokentype = tokentype
+        return TokenID, rulesets
 
     @staticmethod
     def __tmscvt(tms):
@@ -129,6 +243,50 @@ class Tokenizer:
 
         return tmsmap
 
+    @staticmethod
+    def _combine_rules(tms):
+        """Return tms with some runs of rules made into _TokenMatchGroups.
+
+        The runs combined are: consecutive keywords, and consecutive
+        single (literal) character rules. See _TokenMatchGroup.
+        """
+
+        combined = []
+        run = []
+        runkind = None
+
+        def _endrun():
+            if len(run) > 1:
+                combined.append(runkind(run))
+            else:
+                combined.extend(run)
+            run.clear()
+
+        for tm in tms:
+            if _TokenMatchGroup.combinable_keyword(tm):
+                kind = _TokenMatchGroup.from_keywords
+            elif _TokenMatchGroup.literal_char(tm) is not None:
+                kind = _TokenMatchGroup.from_chars
+            else:
+                kind = None
+
+            if kind != runkind:          # (bound methods; not 'is')
+                _endrun()
+                runkind = kind
+            elif kind == _TokenMatchGroup.from_keywords:
+                # See CAUTION in from_keywords; start a new run if
+                # this keyword extends any keyword already in the run
+                if any(tm.keyword.startswith(x.keyword) and
+                       tm.keyword != x.keyword for x in run):
+                    _endrun()
+
+            if kind is None:
+                combined.append(tm)
+            else:
+                run.append(tm)
+        _endrun()
+        return combined
+
     @classmethod
     def create_tokenID_enum(cls, tms):
         """Can be called separately to make a TokenID Enum from rules."""
@@ -138,7 +296,44 @@ class Tokenizer:
         # NOTE: weed out duplicates (using set()); dups are allowable
         #       when there are multiple context-dependent TokenMatch lists
         toknames = set(r.tokname for mx in tmsmap.values() for r in mx)
-        return Enum('TokenID', sorted(toknames))
+        return _TokenIDEnum('TokenID', sorted(toknames))
+
+    @classmethod
+    def specialize(cls, tms, /, *, tokenIDs=None, remodule=re):
+        """Return a Tokenizer subclass with the rules tms built in.
+
+        All of the work of turning the rules into the regexps etc the
+        Tokenizer uses is done once, here, instead of every time a
+        Tokenizer is created. The returned class is created with:
+
+           cls(strings=None, /, **kwargs)
+
+        i.e., the same as Tokenizer but without the rules (tms) and the
+        other rules-related arguments (which are given here instead).
+
+        If cls (a Tokenizer subclass) has its own __init__, that is still
+        called, with the rules (tms) as its first argument, and it must
+        in turn pass them (unaltered) to Tokenizer.__init__.
+
+        NOTE: All instances of the returned class share one TokenID.
+        """
+
+        built = cls._build_rules(tms, tokenIDs, remodule)
+
+        class SpecializedTokenizer(cls):
+            TokenID, rulesets = built
+            _specialized = (tms, built)
+
+            def __init__(self, strings=None, /, **kwargs):
+                for kw in ('tokenIDs', 'remodule'):
+                    if kw in kwargs:
+                        raise TypeError(
+                            f"{kw!r} can only be given to specialize()")
+                super().__init__(tms, strings, **kwargs)
+
+        SpecializedTokenizer.__name__ = f"Specialized{cls.__name__}"
+        SpecializedTokenizer.__qualname__ = SpecializedTokenizer.__name__
+        return SpecializedTokenizer
 
     # Iterating over a Tokenizer is the same as iterating over
     # the tokens() method, but without the ability to specify other args.
@@ -163,6 +358,21 @@ class Tokenizer:
                srcname=_NOTGIVEN, startnum=_NOTGIVEN):
         """GENERATE tokens. See __init__() for arg descriptions."""
 
+        g = self._numbered_strings(strings, srcname, startnum)
+
+        # All the lines are run through one _tokenize() loop, rather
+        # than setting up a string_to_tokens() generator per line.
+        # But if a subclass has its own string_to_tokens, honor that.
+        if type(self).string_to_tokens is Tokenizer.string_to_tokens:
+            yield from self._tokenize(g, self.srcname)
+        else:
+            for i, s in g:
+                yield from self.string_to_tokens(
+                    s, linenumber=i, name=self.srcname)
+
+    def _numbered_strings(self, strings, srcname, startnum):
+        """Support for tokens() etc; returns iterable of (lineno, s)."""
+
         if strings is not None:
             self.strings = strings
 
@@ -174,12 +384,72 @@ class Tokenizer:
             self.startnum = startnum
 
         if self.startnum is None:         # no line numbers
-            g = ((None, s) for s in self.strings)
+            return ((None, s) for s in self.strings)
         else:
-            g = enumerate(self.strings, start=self.startnum)
-        for i, s in g:
-            yield from self.string_to_tokens(
-                s, linenumber=i, name=self.srcname)
+            return enumerate(self.strings, start=self.startnum)
+
+    def tokens_batch(self, strings=None, /, *, batchsize=4096, full=False,
+                     srcname=_NOTGIVEN, startnum=_NOTGIVEN):
+        """GENERATE tokens in batches, as TokenBatch objects.
+
+        A TokenBatch holds up to batchsize tokens as parallel lists:
+           ids       -- the token ids
+           values    -- the token values
+           linenos   -- line number of the string each token came from
+           starts    -- start index of each match within its string
+           ends      -- ONE PAST the end of each match
+           locations -- TokLoc for each token if full is True, else None
+
+        This is the same tokenizing as tokens(), but for the (common)
+        rules that just make a plain token no Token (and, unless full is
+        True, no TokLoc) objects are made. Rules whose action() makes the
+        token still work, but that token (built with the tokentype, if
+        the action uses it) must have id and value attributes, and also
+        a location attribute if full is True. string_to_tokens is not used.
+
+        If a MatchError occurs, the tokens before it are yielded (as a
+        final, possibly short, batch) before the exception is raised.
+
+        NOTE: A batch is tokenized before it is yielded, so (unlike with
+              tokens()) the consumer cannot switch rulesets in between
+              tokens with activate_ruleset(); rulesets can still be
+              switched by the rules themselves (TokenMatchRuleSwitch).
+
+        See __init__() for other arg descriptions.
+        """
+
+        lines = self._numbered_strings(strings, srcname, startnum)
+
+        batch = TokenBatch([], [], [], [], [], [] if full else None)
+        ids, values, linenos, starts, ends, locs = batch
+
+        try:
+            for tok, tokid, value, lineno, start, end, loc in self._scan(
+                    lines, self.srcname, full):
+                if tok is not None:
+                    tokid = tok.id
+                    value = tok.value
+                    if full:
+                        loc = tok.location
+                ids.append(tokid)
+                values.append(value)
+                linenos.append(lineno)
+                starts.append(start)
+                ends.append(end)
+                if full:
+                    locs.append(loc)
+
+                if len(ids) >= batchsize:
+                    yield batch
+                    batch = TokenBatch(
+                        [], [], [], [], [], [] if full else None)
+                    ids, values, linenos, starts, ends, locs = batch
+        except self.MatchError:
+            if ids:
+                yield batch
+            raise
+        if ids:
+            yield batch
 
     def string_to_tokens(self, s, /, *, linenumber=None, name=None):
         """Tokenize string 's', yield Tokens.
@@ -187,46 +457,122 @@ class Tokenizer:
            NOTE: optional keyword arguments linenumber and name are
                  entirely for making a TokLoc for better error reporting.
         """
+        yield from self._tokenize(((linenumber, s),), name)
 
-        so_far = 0
-        prevrules = None
-
-        # Note that TokenMatch objects can cause active_rulesname to change
-        # so the loop is written this way to accommodate that.
-        while True:
-            # this fires on any rules change AND ALSO the first time through
-            if prevrules is not self.rules:
-                prevrules = self.rules
-                g = re.finditer(self.rules.joined_rx, s[so_far:])
-                baseoffset = so_far
+    def _tokenize(self, lines, name, /):
+        """Tokenize (linenumber, s) pairs from lines, yield Tokens."""
 
-            # 'tm' is the TokenMatch that matched
-            tm, value, startrel, stoprel = self._nextmatch(g)
-            start = startrel + baseoffset
-            if tm is None or start != so_far:
-                break
+        tokentype = self.tokentype
 
-            so_far = stoprel + baseoffset   # end of processed chars in s
-            loc = TokLoc(s, name, linenumber, start, so_far)
+        # Token (if that's the tokentype) is a namedtuple, and calling
+        # tuple.__new__ directly skips its (python) __new__.
+        tuple_new = tuple.__new__
+        native = tokentype is Token
 
-            tok = tm.action(value, loc, self)
+        for tok, tokid, value, _, _, _, loc in self._scan(
+                lines, name, True):
             if tok is not None:
                 yield tok
+            elif native:
+                yield tuple_new(Token, (tokid, value, loc))
+            else:
+                yield tokentype(tokid, value, loc)
+
+    def _scan(self, lines, name, makeloc, /):
+        """The tokenizing loop shared by _tokenize and tokens_batch.
+
+        Yields (tok, tokid, value, linenumber, start, end, loc) per token.
+        For a rule whose action() is known to just make a plain token,
+        tok is None and the token is described by tokid/value/loc (loc
+        is None unless makeloc). Otherwise tok is what action() made
+        (tokens it suppressed are not yielded) and tokid/value are None.
+        """
 
-        # If haven't made it to the end, something didn't match along the way
-        if so_far != len(s):
-            loc = TokLoc(s, name, linenumber, so_far, so_far)
-            raise self.MatchError(f"unmatched @{so_far}, {s=}", location=loc)
-
-    def _nextmatch(self, g):
-        """Support for string_to_tokens; returns next match and info"""
+        # Everything used per-token is bound to a local first; this
+        # loop is where essentially all the tokenizing time goes.
+        rules = self.rules
+        match = rules.compiled.match
+        finditer = rules.compiled.finditer
+        pmap = rules.pmap
+        inlines = rules.inline
+        Group = _TokenMatchGroup
+
+        # TokLoc is a namedtuple, and calling tuple.__new__ directly
+        # skips its (python) __new__.
+        tuple_new = tuple.__new__
+
+        for linenumber, s in lines:
+            slen = len(s)
+            so_far = 0
+            must_advance = False
+
+            # Each match is anchored at so_far; the first position that no
+            # rule matches ends the loop. TokenMatch objects (or the
+            # consumer of the tokens) can cause the active ruleset to
+            # change, which means the next match uses the (new) self.rules.
+            #
+            # A zero-length match is allowed (including at the very end
+            # of s, e.g., for r'$'), but then - as with finditer - the
+            # next match at that same spot must be non-empty. There's no
+            # way to ask match() for that, so use finditer: its second
+            # match is exactly that (or is further along, or is None).
+            while True:
+                if must_advance:
+                    it = finditer(s, so_far)
+                    next(it)
+                    mobj = next(it, None)
+                    if mobj is not None and mobj.start() != so_far:
+                        mobj = None
+                else:
+                    mobj = match(s, so_far)
+                if mobj is None:
+                    break
+
+                # 'tm' is the TokenMatch that matched
+                i = mobj.lastindex
+                tm = pmap[i]
+                value = mobj.group(0)
+                start, so_far = so_far, mobj.end()
+
+                # Inline what the base action() would do, when it's known
+                # that is what would happen (see _inline in _build_rules)
+                inline = inlines[i]
+                if inline is None and tm.__class__ is Group:
+                    inline = tm.inline_by_value[value]
+                    tm = tm.tms_by_value[value]
+
+                if inline is not None:
+                    tokid, cvt = inline
+                    if cvt is not None:
+                        value = cvt(value)
+                    if makeloc:
+                        loc = tuple_new(
+                            TokLoc, (s, name, linenumber, start, so_far))
+                    else:
+                        loc = None
+                    yield None, tokid, value, linenumber, start, so_far, loc
+                else:
+                    loc = tuple_new(
+                        TokLoc, (s, name, linenumber, start, so_far))
+                    tok = tm.action(value, loc, self)
+                    if tok is not None:
+                        yield tok, None, None, linenumber, start, so_far, loc
+
+                if self.rules is not rules:
+                    rules = self.rules
+                    match = rules.compiled.match
+                    finditer = rules.compiled.finditer
+                    pmap = rules.pmap
+                    inlines = rules.inline
+                    must_advance = False
+                else:
+                    must_advance = so_far == start
 
-        try:
-            mobj = next(g)
-        except StopIteration:
-            return None, None, -1, -1
-        tm = self.rules.pmap[mobj.lastgroup]
-        return tm, mobj.group(0), mobj.start(), mobj.end()
+            # If haven't made it to the end, something didn't match
+            if so_far != slen:
+                loc = TokLoc(s, name, linenumber, so_far, so_far)
+                raise self.MatchError(f"unmatched @{so_far}, {s=}",
+                                      location=loc)
 
     class MatchError(Exception):
         """Exception raised when the input doesn't match any rules"""
@@ -263,12 +609,8 @@ class Tokenizer:
 
             escaped = False
             if s.endswith('\\\n'):
-                lastslash = 0
-                for pos in range(len(s)-3, -1, -1):
-                    if s[pos] != '\\':
-                        lastslash = pos + 1
-                        break
-                nslashes = (len(s) - 1) - lastslash
+                body = s[:-1]
+                nslashes = len(body) - len(body.rstrip('\\'))
                 # if it's odd then the \n is escaped
                 escaped = (nslashes % 2)
                 if escaped:
@@ -303,14 +645,27 @@ class TokenMatch:
     id_ascii = r'[A-Za-z_][A-Za-z_0-9]*'
     id_ascii_no_under = r'[A-Za-z][A-Za-z0-9]*'
 
+    # True if action() is the base TokenMatch.action(), in which case
+    # the Tokenizer is allowed to bypass calling it and build the token
+    # itself. Computed automatically for every subclass; see below.
+    _passthrough = True
+
+    def __init_subclass__(cls, /, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._passthrough = cls.action is TokenMatch.action
+
     def __init__(self, tokname, regexp, /):
         self.tokname = tokname
         self.regexp = regexp
 
         # fail early, because failing later is very confusing...
+        # The compiled regexp is kept; it's there for anything that wants
+        # to examine or match this one rule on its own (the Tokenizer
+        # itself matches with the joined regexp of the whole ruleset).
+        self._compiled = None
         if regexp is not None:
             try:
-                _ = re.compile(regexp)
+                self._compiled = re.compile(regexp)
             except re.error:
                 raise ValueError(
                     self.__class__.__name__ +
@@ -381,8 +736,10 @@ class TokenMatchKeyword(TokenMatch):
        where 'magic' is "not the TokenMatch.id_unicode expression"
     """
     def __init__(self, tokname, regexp=None, *args, **kwargs):
+        self.keyword = None
         if regexp is None:
             regexp = self.keyword_regexp(tokname)
+            self.keyword = tokname
         super().__init__(tokname.upper(), regexp, *args, **kwargs)
 
     # broken out so can be overridden if application has other syntax
@@ -390,6 +747,107 @@ class TokenMatchKeyword(TokenMatch):
         return f"({tokname})(?!{TokenMatch.id_unicode})"
 
 
+# Internal to the Tokenizer: several TokenMatch objects combined into
+# a single regexp, with the matched string (the value) determining
+# which of the original TokenMatch objects the match belongs to.
+#
+# This is how runs of TokenMatchKeyword objects are handled. Rather
+# than one alternative per keyword in the joined regexp, e.g.:
+#     (if)(?!magic)|(in)(?!magic)|(int)(?!magic)
+# they become one prefix-tree alternative:
+#     (i(?:f|nt?))(?!magic)
+# which the re module can reject (or accept) a character at a time
+# instead of trying every keyword in turn.
+#
+# Similarly, runs of rules that each match one literal character, e.g.:
+#     (\{)|(\})|(;)|(,)
+# become one character-class alternative:
+#     ([\{\};,])
+
+class _TokenMatchGroup(TokenMatch):
+    def __init__(self, regexp, tms_by_value, /):
+        super().__init__(None, regexp)
+        self.tms_by_value = tms_by_value
+        self.inline_by_value = dict.fromkeys(tms_by_value)  # see Tokenizer
+
+    def action(self, val, loc, tkz, /):
+        return self.tms_by_value[val].action(val, loc, tkz)
+
+    # Only plain TokenMatchKeyword objects with the default regexp
+    # are combinable, and only if the keyword is a literal (keywords
+    # are really regexps, which could make the prefix-tree wrong).
+    @staticmethod
+    def combinable_keyword(tm):
+        return (type(tm) is TokenMatchKeyword and
+                tm.keyword is not None and
+                re.fullmatch(r'\w+', tm.keyword) is not None)
+
+    @classmethod
+    def from_keywords(cls, tms):
+        """Make a _TokenMatchGroup from TokenMatchKeyword objects.
+
+        CAUTION: The prefix-tree regexp always prefers the longest
+                 keyword. That is only the same as trying the keywords
+                 in order if no keyword is a prefix of a later one;
+                 it is up to the caller to ensure that.
+        """
+        tms_by_value = {}
+        for tm in tms:
+            tms_by_value.setdefault(tm.keyword, tm)
+
+        trie = {}
+        for kw in tms_by_value:
+            node = trie
+            for c in kw:
+                node = node.setdefault(c, {})
+            node[None] = None            # marks the end of a keyword
+
+        def _rx(node):
+            alts = [re.escape(c) + _rx(sub)
+                    for c, sub in node.items() if c is not None]
+            if not alts:
+                return ""
+            if len(alts) == 1 and None not in node:
+                return alts[0]
+            rx = "(?:" + "|".join(alts) + ")"
+            return rx + "?" if None in node else rx
+
+        regexp = f"({_rx(trie)})(?!{TokenMatch.id_unicode})"
+        return cls(regexp, tms_by_value)
+
+    # If tm matches exactly one literal character, return it (else None)
+    @staticmethod
+    def literal_char(tm):
+        rx = tm.regexp
+        if rx is None:
+            return None
+        if len(rx) == 2 and rx[0] == '\\' and not rx[1].isalnum():
+            c = rx[1]                    # e.g., r'\{' or r'\+'
+        elif len(rx) == 1 and rx not in '.^$*+?()[]|\\':
+            c = rx                       # e.g., ';' or '{'
+        else:
+            return None
+
+        # (a subclass not using TokenMatch.__init__ has no _compiled)
+        compiled = getattr(tm, '_compiled', None)
+        if compiled is None or not compiled.fullmatch(c):
+            return None
+        return c
+
+    @classmethod
+    def from_chars(cls, tms):
+        """Make a _TokenMatchGroup from single literal character rules."""
+        tms_by_value = {}
+        for tm in tms:
+            tms_by_value.setdefault(cls.literal_char(tm), tm)
+
+        regexp = "[" + "".join(map(re.escape, tms_by_value)) + "]"
+        return cls(regexp, tms_by_value)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self.tms_by_value)})"
+
+
 class TokenMatchIgnoreButKeep(TokenMatch):
     def __init__(self, *args, keep, **kwargs):
         super().__init__(*args, **kwargs)
@@ -428,6 +886,7 @@ TokLoc = namedtuple('TokLoc',
 
 if __name__ == "__main__":
     import unittest
+    from types import ModuleType
 
     class TestMethods(unittest.TestCase):
 
@@ -548,6 +1007,139 @@ if __name__ == "__main__":
                 # just knows each test is 1 char
                 self.assertEqual(t.location.endpos, startpos+1)
 
+        # tokens() must still go through an overridden string_to_tokens
+        def test_string_to_tokens_override(self):
+            class UpperTokenizer(Tokenizer):
+                def string_to_tokens(self, s, /, **kwargs):
+                    yield from super().string_to_tokens(s.upper(), **kwargs)
+
+            rules = [TokenMatch('A', 'A'),
+                     TokenMatch('B', 'B')]
+            tkz = UpperTokenizer(rules, ["ab", "ba"])
+            self.assertEqual([t.value for t in tkz], ['A', 'B', 'B', 'A'])
+
+        def test_batch(self):
+            rules = {
+                None: [
+                    TokenMatchIgnoreButKeep('NEWLINE', r'\s+', keep='\n'),
+                    TokenMatchKeyword('if'),
+                    TokenMatchKeyword('then'),
+                    TokenMatch('IDENTIFIER', TokenMatch.id_unicode),
+                    TokenMatchInt('CONSTANT', r'-?[0-9]+'),
+                    TokenMatchRuleSwitch('QUOTE', r'"'),
+                ],
+                'STR': [
+                    TokenMatch('STRCHARS', r'[^"]+'),
+                    TokenMatchRuleSwitch('QUOTE', r'"'),
+                ]
+            }
+
+            lines = ["if abc then 17\n", "\n", 'x "a b c" 42 y\n', "then"]
+            tkz = Tokenizer(rules)
+            toks = list(tkz.tokens(lines))
+            for batchsize in (1, 3, 4096):
+                for full in (False, True):
+                    with self.subTest(batchsize=batchsize, full=full):
+                        tkz = Tokenizer(rules)
+                        batches = list(tkz.tokens_batch(
+                            lines, batchsize=batchsize, full=full))
+                        self.assertTrue(
+                            all(len(b.ids) <= batchsize for b in batches))
+                        ids, values, linenos = [], [], []
+                        starts, ends, locs = [], [], []
+                        for b in batches:
+                            ids += b.ids
+                            values += b.values
+                            linenos += b.linenos
+                            starts += b.starts
+                            ends += b.ends
+                            if full:
+                                locs += b.locations
+                            else:
+                                self.assertIsNone(b.locations)
+                        self.assertEqual(ids, [t.id for t in toks])
+                        self.assertEqual(values, [t.value for t in toks])
+                        self.assertEqual(
+                            linenos, [t.location.lineno for t in toks])
+                        self.assertEqual(
+                            starts, [t.location.startpos for t in toks])
+                        self.assertEqual(
+                            ends, [t.location.endpos for t in toks])
+                        if full:
+                            self.assertEqual(
+                                locs, [t.location for t in toks])
+
+        def test_batch_nomatch(self):
+            rules = [TokenMatch('A', 'a'),
+                     TokenMatch('B', 'b')]
+            tkz = Tokenizer(rules)
+            g = tkz.tokens_batch(["ab", "baxb"], batchsize=3)
+            self.assertEqual(next(g).ids, [tkz.TokenID.A, tkz.TokenID.B,
+                                           tkz.TokenID.B])
+            self.assertEqual(next(g).ids, [tkz.TokenID.A])
+            with self.assertRaises(Tokenizer.MatchError):
+                next(g)
+
+        def test_specialize(self):
+            rules = {
+                None: [
+                    TokenMatchIgnore('WHITESPACE', r'\s+'),
+                    TokenMatchKeyword('if'),
+                    TokenMatch('IDENTIFIER', TokenMatch.id_unicode),
+                    TokenMatchInt('CONSTANT', r'-?[0-9]+'),
+                    TokenMatchRuleSwitch('QUOTE', r'"'),
+                ],
+                'STR': [
+                    TokenMatch('STRCHARS', r'[^"]+'),
+                    TokenMatchRuleSwitch('QUOTE', r'"'),
+                ]
+            }
+            lines = ['if x "abc', 'def" 42 "']
+
+            Tkz = Tokenizer.specialize(rules)
+            tkz1 = Tkz(lines, srcname='foo')
+            tkz2 = Tkz()
+            self.assertIsInstance(tkz1, Tokenizer)
+            self.assertIs(tkz1.TokenID, tkz2.TokenID)
+
+            # a ruleset switch in one does not affect the other
+            toks = list(tkz1.tokens())
+            self.assertEqual(tkz1.rules.name, 'STR')
+            self.assertEqual(tkz2.rules.name, None)
+
+            ref = Tokenizer(rules, lines, srcname='foo')
+            expected = [(t.id.name, t.value, t.location)
+                        for t in ref.tokens()]
+            self.assertEqual([(t.id.name, t.value, t.location)
+                              for t in toks], expected)
+
+            # rules-related arguments belong to specialize()
+            with self.assertRaises(TypeError):
+                Tkz(lines, remodule=re)
+
+        def test_specialize_subclass(self):
+            # a subclass with its own __init__ can be specialized too
+            class CountingTokenizer(Tokenizer):
+                def __init__(self, tms, strings=None, /, **kwargs):
+                    self.count = 0
+                    super().__init__(tms, strings, **kwargs)
+
+                def string_to_tokens(self, s, /, **kwargs):
+                    for t in super().string_to_tokens(s, **kwargs):
+                        self.count += 1
+                        yield t
+
+            rules = [TokenMatchIgnore('WHITESPACE', r'\s+'),
+                     TokenMatch('IDENTIFIER', TokenMatch.id_unicode)]
+            Tkz = CountingTokenizer.specialize(rules)
+            tkz = Tkz(["a b", "c"], startnum=5)
+            self.assertIsInstance(tkz, CountingTokenizer)
+            self.assertIs(tkz.rulesets, Tkz.rulesets)
+            self.assertEqual([t.value for t in tkz.tokens()],
+                             ['a', 'b', 'c'])
+            self.assertEqual(tkz.count, 3)
+            self.assertEqual(tkz.startnum, 5)
+
         def test_nomatch(self):
             rules = [TokenMatch('A', 'a'),
                      TokenMatch('B', 'b')]
@@ -571,6 +1163,36 @@ if __name__ == "__main__":
                 else:
                     self.assertEqual(expected_id, t.id)
 
+        def test_emptymatch(self):
+            # rules that can match zero characters; after an empty match
+            # a non-empty match must still be tried at the same spot
+            rules = [TokenMatchIgnore('WS', r'\s*'),
+                     TokenMatch('ID', TokenMatch.id_unicode),
+                     TokenMatch('N', r'[0-9]+')]
+            tkz = Tokenizer(rules)
+            self.assertEqual(
+                [(t.id.name, t.value)
+                 for t in tkz.string_to_tokens("foo 12 bar")],
+                [('ID', 'foo'), ('N', '12'), ('ID', 'bar')])
+
+            # batches must agree
+            batch, = tkz.tokens_batch(["foo 12 bar"])
+            self.assertEqual([tokid.name for tokid in batch.ids],
+                             ['ID', 'N', 'ID'])
+
+        def test_eol(self):
+            # an r'$' rule gets its (empty) token, including on empty lines
+            rules = [TokenMatchIgnore('WS', r'\s+'),
+                     TokenMatch('ID', TokenMatch.id_unicode),
+                     TokenMatch('EOL', r'$')]
+            tkz = Tokenizer(rules, ["foo bar", "", "  baz"])
+            self.assertEqual(
+                [(t.id.name, t.value, t.location.lineno)
+                 for t in tkz.tokens()],
+                [('ID', 'foo', 1), ('ID', 'bar', 1), ('EOL', '', 1),
+                 ('EOL', '', 2),
+                 ('ID', 'baz', 3), ('EOL', '', 3)])
+
         # C comment example
         def test_C(self):
             rules = [
@@ -624,6 +1246,74 @@ if __name__ == "__main__":
                     for name, t in zip(expected, toks):
                         self.assertEqual(tkz.TokenID[name], t.id)
 
+        # an alternate regular expression module can be supplied
+        def test_remodule(self):
+            # A stand-in regular expression module that provides only
+            # what the remodule argument is documented to need.
+            class Match:
+                __slots__ = ('lastindex', '_m')
+
+                def __init__(self, m):
+                    self._m = m
+                    self.lastindex = m.lastindex
+
+                def group(self, n):
+                    return self._m.group(n)
+
+                def start(self):
+                    return self._m.start()
+
+                def end(self):
+                    return self._m.end()
+
+            class Pattern:
+                __slots__ = ('groups', 'groupindex', '_p')
+
+                def __init__(self, rx):
+                    self._p = re.compile(rx)
+                    self.groups = self._p.groups
+                    self.groupindex = dict(self._p.groupindex)
+
+                def match(self, s, pos):
+                    m = self._p.match(s, pos)
+                    return None if m is None else Match(m)
+
+                def finditer(self, s, pos):
+                    return map(Match, self._p.finditer(s, pos))
+
+            compiled = []
+
+            def fakecompile(rx):
+                compiled.append(rx)
+                return Pattern(rx)
+
+            remodule = ModuleType('fakere')
+            remodule.compile = fakecompile
+
+            # keywords, characters, inner groups, and zero-length matches
+            rules = [TokenMatchIgnore('WHITESPACE', r'\s*'),
+                     TokenMatchKeyword('if'),
+                     TokenMatchKeyword('in'),
+                     TokenMatch('LBRACE', r'\{'),
+                     TokenMatch('RBRACE', r'\}'),
+                     TokenMatch('PAIR', r'(x)(y)'),
+                     TokenMatch('IDENTIFIER', TokenMatch.id_unicode),
+                     TokenMatch('EOL', r'$')]
+            s = 'if { xy inx in }'
+            tkz = Tokenizer(rules, remodule=remodule)
+            self.assertEqual(len(compiled), 1)
+            ref = Tokenizer(rules)
+            self.assertEqual(
+                [(t.id.name, t.value) for t in tkz.string_to_tokens(s)],
+                [(t.id.name, t.value) for t in ref.string_to_tokens(s)])
+
+            # a second Tokenizer from the same rules reuses the result
+            tkz = Tokenizer(rules, remodule=remodule)
+            self.assertEqual(len(compiled), 1)
+
+            # ... from a cache that does not grow without bound
+            self.assertIsNotNone(_compile.cache_info().maxsize)
+
         # check that duplicated toknames are allowed
         def test_dups(self):
             rules = [TokenMatch('FOO', 'f'),
@@ -636,6 +1326,72 @@ if __name__ == "__main__":
                 self.assertEqual(token.id, tkz.TokenID[ex[0]])
                 self.assertEqual(token.value, ex[1])
 
+        # groups inside the individual regexps must not confuse the
+        # mapping from a match back to its TokenMatch
+        def test_groups(self):
+            rules = [TokenMatch('PAIR', r'(a)(b)'),
+                     TokenMatch('NESTED', r'((c)(?P<named>d))'),
+                     TokenMatch('OPTIONAL', r'e(f)?'),
+                     TokenMatch('A', 'a')]
+            tkz = Tokenizer(rules)
+
+            expected = (('PAIR', 'ab'), ('NESTED', 'cd'), ('OPTIONAL', 'e'),
+                        ('A', 'a'), ('OPTIONAL', 'ef'))
+            toks = list(tkz.string_to_tokens('abcdeaef'))
+            self.assertEqual(len(toks), len(expected))
+            for token, ex in zip(toks, expected):
+                self.assertEqual(token.id, tkz.TokenID[ex[0]])
+                self.assertEqual(token.value, ex[1])
+
+        def test_tokenID_enum(self):
+            rules = [TokenMatch('A', 'a'),
+                     TokenMatch('B', 'b')]
+            tkz = Tokenizer(rules)
+            self.assertTrue(issubclass(tkz.TokenID, IntEnum))
+            self.assertEqual(str(tkz.TokenID.A), 'TokenID.A')
+            self.assertEqual(f"{tkz.TokenID.B}", 'TokenID.B')
+
+            # the (documented) consequence for ids from other Tokenizers
+            other = Tokenizer([TokenMatch('X', 'x')])
+            self.assertEqual(tkz.TokenID.A, other.TokenID.X)
+            self.assertEqual(len({tkz.TokenID.A, other.TokenID.X}), 1)
+
+        # TokenMatch objects are never hashed or compared by the Tokenizer
+        def test_tm_equality(self):
+            class RxEq(TokenMatch):
+                def __eq__(self, other):
+                    return self.regexp == other.regexp
+
+                def __hash__(self):
+                    return hash(self.regexp)
+
+            class EqOnly(TokenMatch):
+                def __eq__(self, other):
+                    return self is other     # (makes it unhashable)
+
+            rules = {
+                None: [RxEq('A', 'a'),
+                       TokenMatchRuleSwitch('SW', '/', rulename='ALT')],
+                'ALT': [RxEq('B', 'a'),
+                        EqOnly('C', 'c'),
+                        TokenMatchRuleSwitch('SW', '/', rulename=None)]
+            }
+            tkz = Tokenizer(rules)
+            self.assertEqual(
+                [t.id.name for t in tkz.string_to_tokens('a/aca/a')],
+                ['A', 'SW', 'B', 'C', 'B', 'SW', 'A'])
+
+        # tokenIDs can be any mapping, not just an Enum
+        def test_tokenIDs_mapping(self):
+            rules = [TokenMatchIgnore('WHITESPACE', r'\s+'),
+                     TokenMatch('A', 'a'),
+                     TokenMatchKeyword('if'),
+                     TokenMatch('B', 'b')]
+            ids = {'A': 'the-a', 'IF': 'the-if', 'B': 'the-b'}
+            tkz = Tokenizer(rules, tokenIDs=ids)
+            self.assertEqual([t.id for t in tkz.string_to_tokens('a if b')],
+                             ['the-a', 'the-if', 'the-b'])
+
         # Test naked tokenIDs (no regexp)
         def test_tokIDonly(self):
             rules = [
@@ -792,4 +1548,107 @@ if __name__ == "__main__":
                     self.assertEqual(t.id, id)
                     self.assertEqual(t.value, val)
 
+        def test_linefilter(self):
+            lines = ["abc\\\n",            # escaped newline
+                     "def\\\\\n",          # escaped backslash
+                     "\\\n",               # just an escaped newline
+                     "\\\\\\\n",           # escaped backslash, escaped newline
+                     "ghi\n",
+                     "jkl\\\n"]            # escaped newline at EOF
+            expected = ["\n", "abcdef\\\\\n", "\n", "\n",
+                        "\\\\ghi\n", "jkl", "\n"]
+            self.assertEqual(list(Tokenizer.linefilter(lines)), expected)
+            self.assertEqual(
+                list(Tokenizer.linefilter(lines, preservelinecount=False)),
+                [x for x in expected if x != "\n"])
+
+        # runs of keywords are combined internally; make sure that
+        # doesn't change what matches (especially for prefix keywords)
+        def test_keywords_combined(self):
+            rules = [
+                TokenMatchIgnore('WHITESPACE', r'\s+'),
+                TokenMatchKeyword('in'),
+                TokenMatchKeyword('int'),       # 'in' is a prefix of this
+                TokenMatchKeyword('ifdef'),
+                TokenMatchKeyword('if'),
+                TokenMatchKeyword('for'),
+                TokenMatch('IDENTIFIER', TokenMatch.id_unicode),
+                TokenMatchInt('CONSTANT', r'[0-9]+'),
+            ]
+
+            s = "in int if ifdef ifdefs for4 fore in4"
+            tkz = Tokenizer(rules)
+            groups = [tm for tm in tkz.rules.pmap
+                      if isinstance(tm, _TokenMatchGroup)]
+            self.assertEqual(len(groups), 1)      # 'in' is left alone
+            expected = [
+                ('IN', 'in'),
+                ('INT', 'int'),
+                ('IF', 'if'),
+                ('IFDEF', 'ifdef'),
+                ('IDENTIFIER', 'ifdefs'),
+                ('FOR', 'for'),
+                ('CONSTANT', 4),
+                ('IDENTIFIER', 'fore'),
+                ('IN', 'in'),
+                ('CONSTANT', 4),
+            ]
+            toks = list(tkz.string_to_tokens(s))
+            self.assertEqual(len(toks), len(expected))
+            for t, x in zip(toks, expected):
+                with self.subTest(t=t, x=x):
+                    self.assertEqual(t.id, tkz.TokenID[x[0]])
+                    self.assertEqual(t.value, x[1])
+
+        # same idea, for runs of single-character rules
+        def test_chars_combined(self):
+            rules = [
+                TokenMatch('LBRACE', r'\{'),
+                TokenMatch('RBRACE', r'}'),
+                TokenMatch('ID', r'[a-z]+'),    # not a literal; breaks run
+                TokenMatch('SEMI', r';'),
+                TokenMatchIgnore('SPACE', r' '),
+                TokenMatch('SEMI2', r';'),      # never matches; SEMI first
+                TokenMatchInt('DIGIT', r'7'),
+                TokenMatch('PLUS', r'\+'),
+                TokenMatch('ANY', r'.'),        # not a literal
+            ]
+
+            tkz = Tokenizer(rules)
+            groups = [tm for tm in tkz.rules.pmap
+                      if isinstance(tm, _TokenMatchGroup)]
+            self.assertEqual(len(groups), 2)
+
+            expected = [
+                ('LBRACE', '{'),
+                ('RBRACE', '}'),
+                ('SEMI', ';'),
+                ('ID', 'x'),
+                ('DIGIT', 7),
+                ('PLUS', '+'),
+                ('SEMI', ';'),
+                ('ANY', '.'),
+            ]
+            toks = list(tkz.string_to_tokens("{} ;x7+ ;."))
+            self.assertEqual(len(toks), len(expected))
+            for t, x in zip(toks, expected):
+                with self.subTest(t=t, x=x):
+                    self.assertEqual(t.id, tkz.TokenID[x[0]])
+                    self.assertEqual(t.value, x[1])
+
+            # a subclass that sets up its own attributes (rather than
+            # calling TokenMatch.__init__) is fine, just not combined
+            class OwnInit(TokenMatch):
+                def __init__(self, tokname, regexp):
+                    self.tokname = tokname
+                    self.regexp = regexp
+
+            rules = [TokenMatch('COMMA', ','),
+                     OwnInit('SEMI', ';'),
+                     TokenMatch('COLON', ':')]
+            tkz = Tokenizer(rules)
+            self.assertEqual(
+                [t.id.name for t in tkz.string_to_tokens(',;:')],
+                ['COMMA', 'SEMI', 'COLON'])
+
     unittest.main()